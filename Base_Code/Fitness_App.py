@@ -2,17 +2,66 @@ import streamlit as st
 import pandas as pd
 import numpy as np
 import sqlite3
+import os
+import io
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 from datetime import date
+from typing import Final
 
 # --- 1. DATABASE LOGIC ---
+DB_PATH = 'fitness_data.db'
+# Dates are stored as INTEGER days since this epoch: fixed-width, natively sortable keys
+EPOCH = date(1970, 1, 1)
+
+def to_day(d):
+    return (d - EPOCH).days
+
+def day_to_date(days):
+    # Only for display: int days map straight onto datetime64[D] without parsing
+    return np.asarray(days, dtype=np.int64).astype('datetime64[D]')
+
+def migrate_text_dates(conn, table):
+    # Databases created before the switch keep ISO date strings; rebuild those
+    # tables keyed by epoch day, keeping every other column as it was
+    cols = conn.execute(f"PRAGMA table_info({table})").fetchall()
+    if ('date', 'TEXT') not in [(col[1], col[2]) for col in cols]:
+        return
+    others = [col[1] for col in cols if col[1] != 'date']
+    defs = ', '.join(f"{col[1]} {col[2]}" for col in cols if col[1] != 'date')
+    names = ', '.join(others)
+    # An unparseable date would become a NULL rowid, which SQLite silently replaces
+    # with max(rowid)+1; refuse to migrate rather than re-date rows
+    bad = conn.execute(f"SELECT count(*) FROM {table} WHERE julianday(date) IS NULL").fetchone()[0]
+    if bad:
+        raise ValueError(f"{table}: {bad} row(s) have dates SQLite can't parse; fix them before upgrading")
+    conn.execute("BEGIN")
+    try:
+        conn.execute(f"ALTER TABLE {table} RENAME TO {table}_text")
+        conn.execute(f"CREATE TABLE {table} (date INTEGER PRIMARY KEY, {defs})")
+        conn.execute(f'''
+            INSERT INTO {table} (date, {names})
+            SELECT CAST(julianday(date) - julianday('1970-01-01') AS INTEGER), {names}
+            FROM {table}_text
+        ''')
+        conn.execute(f"DROP TABLE {table}_text")
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+    conn.commit()
+
+# One connection per server process instead of reconnecting on every rerun
+@st.cache_resource
 def init_db():
-    conn = sqlite3.connect('fitness_data.db', check_same_thread=False)
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
     c = conn.cursor()
+    # WAL lets reads proceed during writes and avoids an fsync per small commit
+    c.execute("PRAGMA journal_mode=WAL")
+    c.execute("PRAGMA synchronous=NORMAL")
+    c.execute("PRAGMA temp_store=MEMORY")
     c.execute('''
         CREATE TABLE IF NOT EXISTS daily_stats (
-            date TEXT PRIMARY KEY,
+            date INTEGER PRIMARY KEY,
             weight REAL,
             active_calories INTEGER,
             exercise_mins INTEGER,
@@ -21,7 +70,7 @@ def init_db():
     ''')
     c.execute('''
     CREATE TABLE IF NOT EXISTS nutrition (
-        date TEXT PRIMARY KEY,
+        date INTEGER PRIMARY KEY,
         calories_in INTEGER,
         protein INTEGER,
         carbs INTEGER,
@@ -29,26 +78,193 @@ def init_db():
     )
     ''')
     conn.commit()
+    for table in ('daily_stats', 'nutrition'):
+        migrate_text_dates(conn, table)
     return conn
 
 conn = init_db()
 
+# Update the existing row in place instead of INSERT OR REPLACE's delete + reinsert
+UPSERT_STATS = '''
+    INSERT INTO daily_stats (date, weight, active_calories, exercise_mins, workout_type)
+    VALUES (?,?,?,?,?)
+    ON CONFLICT(date) DO UPDATE SET
+        weight = excluded.weight,
+        active_calories = excluded.active_calories,
+        exercise_mins = excluded.exercise_mins,
+        workout_type = excluded.workout_type
+'''
+UPSERT_NUTRITION = '''
+    INSERT INTO nutrition (date, calories_in, protein, carbs, fat)
+    VALUES (?,?,?,?,?)
+    ON CONFLICT(date) DO UPDATE SET
+        calories_in = excluded.calories_in,
+        protein = excluded.protein,
+        carbs = excluded.carbs,
+        fat = excluded.fat
+'''
+STATS_COLUMNS = ('date', 'weight', 'active_calories', 'exercise_mins', 'workout_type')
+NUTRITION_COLUMNS = ('date', 'calories_in', 'protein', 'carbs', 'fat')
+WORKOUT_TYPES = ["Strength", "Cardio", "Yoga", "Rest"]
+# Bulk rows must hold the same kinds of values the forms can produce:
+# weight is a non-negative REAL, workout_type one of the form's choices and
+# every other column a non-negative whole number
+REAL_COLUMNS = {'weight'}
+CHOICE_COLUMNS = {'workout_type': WORKOUT_TYPES}
+INT64_MAX = np.iinfo(np.int64).max # SQLite INTEGER is a signed 64-bit value
+
+def wall_clock_day(text):
+    # Keep the date as written: converting an offset stamp such as
+    # '2026-01-05 22:14:03 -0500' to UTC first would move it to a neighbouring day
+    ts = pd.Timestamp(text)
+    if ts is pd.NaT:
+        raise ValueError(f"not a date: {text}")
+    return to_day(ts.date())
+
+def parse_bulk_csv(text, columns):
+    # Expects a header row naming the columns; dates as text in any format pandas reads
+    df = pd.read_csv(io.StringIO(text))
+    missing = [col for col in columns if col not in df.columns]
+    if missing:
+        raise ValueError(f"missing columns: {', '.join(missing)}")
+    df = df[list(columns)]
+    if df.isna().any().any():
+        raise ValueError("every row needs a value in each column")
+
+    if not pd.api.types.is_string_dtype(df['date']):
+        raise ValueError("dates must be written out, e.g. 2026-01-05")
+    values = {'date': df['date'].map(wall_clock_day)}
+
+    for col in columns[1:]:
+        if col in CHOICE_COLUMNS:
+            if not df[col].isin(CHOICE_COLUMNS[col]).all():
+                raise ValueError(f"{col} must be one of: {', '.join(CHOICE_COLUMNS[col])}")
+            values[col] = df[col]
+            continue
+        try:
+            nums = pd.to_numeric(df[col], errors='raise')
+            # read_csv turns True/False into bools, which to_numeric passes through
+            if pd.api.types.is_bool_dtype(nums):
+                raise ValueError("must be a number")
+            if (nums < 0).any():
+                raise ValueError("can't be negative")
+            if col in REAL_COLUMNS:
+                # inf would make every control limit inf/NaN
+                if not np.isfinite(nums.to_numpy(dtype=np.float64)).all():
+                    raise ValueError("must be a finite number")
+                values[col] = nums.astype(np.float64)
+                continue
+            # Bound before casting: int64 would wrap 1e30 to a negative number
+            if (nums > INT64_MAX).any():
+                raise ValueError("too large")
+            if (nums % 1 != 0).any():
+                raise ValueError("must be whole numbers")
+            values[col] = nums.astype(np.int64)
+        except (ValueError, OverflowError) as e:
+            raise ValueError(f"{col}: {e}") from e
+    return list(pd.DataFrame(values).itertuples(index=False, name=None))
+
+def save_many(sql, rows):
+    # One transaction for the whole batch, so a single commit instead of one per row
+    with conn:
+        conn.executemany(sql, rows)
+
+def db_version():
+    # In WAL mode commits land in the -wal file until a checkpoint, so watch both
+    paths = [p for p in (DB_PATH, DB_PATH + '-wal') if os.path.exists(p)]
+    return max(os.path.getmtime(p) for p in paths)
+
+# Cached per DB version so widget reruns don't re-query unchanged tables; only
+# the current version is ever read again, so older frames are evicted.
+# Each query projects only what its tab plots and lets SQLite sort on the
+# date primary key.
+@st.cache_data(max_entries=1)
+def load_stats(version):
+    # The SPC path only does column arithmetic, so skip pandas and hand back a
+    # record array: stats.date / stats.weight without index or block machinery
+    rows = conn.execute("SELECT date, weight FROM daily_stats ORDER BY date").fetchall()
+    return np.array(rows, dtype=[('date', np.int64), ('weight', np.float64)]).view(np.recarray)
+
+@st.cache_data(max_entries=1)
+def load_nutrition(version):
+    return pd.read_sql_query("SELECT date, protein, carbs, fat FROM nutrition ORDER BY date", conn)
+
+@st.cache_data(max_entries=1)
+def load_energy(version):
+    # Inner join: only days with both stats and nutrition logged
+    return pd.read_sql_query('''
+        SELECT s.date, s.active_calories, n.calories_in
+        FROM daily_stats s JOIN nutrition n USING (date)
+        ORDER BY s.date
+    ''', conn)
+
 # --- 2. STATISTICAL & PLOTTING LOGIC ---
-def plot_imr_combined(df, column, title):
-    # Ensure data is sorted by date for moving range calculation
-    df = df.sort_values('date')
-    
+# Constants for n=2 (Standard SPC values)
+E2: Final = 2.66  # Individuals limits: x_bar +/- E2 * mr_bar
+D4: Final = 3.267 # Moving range upper limit: D4 * mr_bar
+
+def calculate_imr_limits(vals):
+    # Calculate Moving Range (MR) straight into one array; the first point has none
+    mr = np.empty_like(vals)
+    mr[0] = np.nan
+    np.abs(np.subtract(vals[1:], vals[:-1], out=mr[1:]), out=mr[1:])
+
     # Calculate I-Chart Components
-    x_bar = df[column].mean()
-    # Calculate Moving Range (MR)
-    df['MR'] = df[column].diff().abs()
-    mr_bar = df['MR'].mean()
-    
-    # Constants for n=2 (Standard SPC values)
-    ucl_i = x_bar + (2.66 * mr_bar)
-    lcl_i = max(0, x_bar - (2.66 * mr_bar)) # Cannot be negative
-    ucl_mr = mr_bar * 3.267
-    
+    x_bar = vals.mean()
+    mr_bar = mr[1:].mean() # Only the leading slot is NaN, so skip it instead of a nanmean mask pass
+
+    ucl_i = x_bar + (E2 * mr_bar)
+    lcl_i = max(0, x_bar - (E2 * mr_bar)) # Cannot be negative
+    ucl_mr = mr_bar * D4
+    return mr, x_bar, mr_bar, ucl_i, lcl_i, ucl_mr
+
+# More points than this can't be told apart on screen
+MAX_PLOT_POINTS = 1000
+
+def downsample_lttb(x, y, n_out):
+    # Largest-Triangle-Three-Buckets: keep the first and last points and, from each
+    # bucket in between, the one forming the largest triangle with its neighbours,
+    # so peaks and dips survive the thinning
+    n = len(y)
+    if n <= n_out:
+        return x, y
+    pos = np.arange(n, dtype=np.float64)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.intp)
+    idx = np.empty(n_out, dtype=np.intp)
+    idx[0], idx[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            cx, cy = pos[hi:edges[i + 2]].mean(), y[hi:edges[i + 2]].mean()
+        else:
+            cx, cy = pos[-1], y[-1]
+        area = np.abs((pos[a] - cx) * (y[lo:hi] - y[a]) - (pos[a] - pos[lo:hi]) * (cy - y[a]))
+        a = lo + int(np.argmax(area))
+        idx[i + 1] = a
+    return x[idx], y[idx]
+
+def plot_imr_combined(arr, column, title):
+    # Rows come date-ordered from SQL, so read the fields as-is.
+    # Tuples are hashable, so unchanged data reuses the cached figure
+    return build_imr(tuple(arr.date.tolist()), tuple(arr[column].tolist()), title)
+
+def imr_series(dates, values):
+    vals = np.asarray(values, dtype=np.float64)
+    mr, x_bar, mr_bar, ucl_i, lcl_i, ucl_mr = calculate_imr_limits(vals)
+
+    # Limits use every point; only the drawn traces are thinned for long histories.
+    # The MR series starts at the second point, the first has no moving range
+    x = day_to_date(dates)
+    x_i, y_i = downsample_lttb(x, vals, MAX_PLOT_POINTS)
+    x_mr, y_mr = downsample_lttb(x[1:], mr[1:], MAX_PLOT_POINTS)
+    return x_i, y_i, x_mr, y_mr, (x_bar, ucl_i, lcl_i, mr_bar, ucl_mr)
+
+# Each data change is a new key; keep only a few recent figures alive
+@st.cache_resource(max_entries=4)
+def build_imr(dates, values, title):
+    x_i, y_i, x_mr, y_mr, (x_bar, ucl_i, lcl_i, mr_bar, ucl_mr) = imr_series(dates, values)
+
     # Create Subplots
     fig = make_subplots(
         rows=2, cols=1, 
@@ -58,25 +274,66 @@ def plot_imr_combined(df, column, title):
     )
 
     # --- TOP CHART: INDIVIDUALS ---
-    fig.add_trace(go.Scatter(x=df['date'], y=df[column], name='Value', mode='lines+markers'), row=1, col=1)
+    fig.add_trace(go.Scattergl(x=x_i, y=y_i, name='Value', mode='lines+markers'), row=1, col=1)
     fig.add_hline(y=x_bar, line_dash="dash", line_color="green", row=1, col=1, annotation_text="Mean")
     fig.add_hline(y=ucl_i, line_dash="dot", line_color="red", row=1, col=1, annotation_text="UCL")
     fig.add_hline(y=lcl_i, line_dash="dot", line_color="red", row=1, col=1, annotation_text="LCL")
 
     # --- BOTTOM CHART: MOVING RANGE ---
-    fig.add_trace(go.Scatter(x=df['date'], y=df['MR'], name='Moving Range', mode='lines+markers', line_color='orange'), row=2, col=1)
+    fig.add_trace(go.Scattergl(x=x_mr, y=y_mr, name='Moving Range', mode='lines+markers', line_color='orange'), row=2, col=1)
     fig.add_hline(y=mr_bar, line_dash="dash", line_color="green", row=2, col=1, annotation_text="Avg MR")
     fig.add_hline(y=ucl_mr, line_dash="dot", line_color="red", row=2, col=1, annotation_text="UCL")
 
     fig.update_layout(height=600, showlegend=False, margin=dict(l=20, r=20, t=40, b=20))
     return fig
 
-def calculate_capability(df, column, lsl, usl):
-    if len(df) < 5: # Need a few points for a valid standard deviation
+def update_imr(fig, arr, column):
+    # Patch an existing I-MR figure in place: new trace data and control-line
+    # levels, keeping the subplots, styling and labels already built
+    x_i, y_i, x_mr, y_mr, levels = imr_series(arr.date, arr[column])
+    with fig.batch_update():
+        fig.data[0].update(x=x_i, y=y_i)
+        fig.data[1].update(x=x_mr, y=y_mr)
+        # Shapes are the hlines in the order build_imr adds them; their labels
+        # follow the two subplot titles in the annotations
+        for line, label, y in zip(fig.layout.shapes, fig.layout.annotations[2:], levels):
+            line.update(y0=y, y1=y)
+            label.update(y=y)
+    return fig
+
+def plot_macros(df):
+    # Tuples are hashable, so unchanged data reuses the cached figure
+    return build_macros(*(tuple(df[col].tolist()) for col in ('date', 'protein', 'carbs', 'fat')))
+
+@st.cache_resource(max_entries=4)
+def build_macros(dates, protein, carbs, fat):
+    # One pre-stacked bar trace per macro, no long-format melt of the frame
+    x = day_to_date(dates)
+    fig = go.Figure()
+    for name, grams in (('protein', protein), ('carbs', carbs), ('fat', fat)):
+        fig.add_bar(x=x, y=grams, name=name)
+    fig.update_layout(barmode='stack', title="Macros Over Time", yaxis_title="Grams")
+    return fig
+
+def plot_net_energy(df):
+    # Storytelling: Calculate Net Calories on the plain column arrays
+    net = df['calories_in'].to_numpy(dtype=np.float64) - df['active_calories'].to_numpy(dtype=np.float64)
+    net -= 2000 # Assuming 2000 BMR
+    return build_net_energy(tuple(df['date'].tolist()), tuple(net.tolist()))
+
+@st.cache_resource(max_entries=4)
+def build_net_energy(dates, net):
+    fig = go.Figure(go.Scatter(x=day_to_date(dates), y=net, name='Net Calories', mode='lines'))
+    fig.update_layout(yaxis_title="Net Calories", margin=dict(l=20, r=20, t=20, b=20))
+    return fig
+
+def calculate_capability(arr, column, lsl, usl):
+    if len(arr) < 5: # Need a few points for a valid standard deviation
         return None, None
     
-    mean = df[column].mean()
-    sigma = df[column].std()
+    vals = np.asarray(arr[column], dtype=np.float64)
+    mean = vals.mean()
+    sigma = vals.std(ddof=1) # Sample std, same as pandas; NumPy's two-pass form stays numerically stable
     
     if sigma == 0: return 0, 0
     
@@ -90,11 +347,25 @@ def calculate_capability(df, column, lsl, usl):
     
     return round(cp, 2), round(cpk, 2)
 
+def session_figure(name, version, build, update=None):
+    # A chart's figure is fully determined by the data version, so when the label
+    # matches the last run's, reuse this session's figure without touching the data.
+    # After a save, charts with an update hook patch that figure instead of rebuilding
+    figures = st.session_state.setdefault('figures', {})
+    label, fig = figures.get(name, (None, None))
+    if label != version:
+        fig = update(fig) if fig is not None and update else build()
+        figures[name] = (version, fig)
+    return fig
+
 # --- 3. STREAMLIT INTERFACE ---
 st.set_page_config(page_title="Fitness & Nutrition SPC", layout="wide")
 st.title("🥗 Fitness & Nutrition Process Control")
 
-with st.sidebar:
+# Switching modes or submitting reruns only this fragment; a save then reruns the
+# whole app so the charts pick up the new data
+@st.fragment
+def input_sidebar():
     menu = st.radio("Select Input Mode", ["Physical Stats", "Nutrition"])
     
     if menu == "Physical Stats":
@@ -103,12 +374,12 @@ with st.sidebar:
             weight = st.number_input("Weight", min_value=0.0, step=0.1)
             active_cal = st.number_input("Active Burned", min_value=0)
             mins = st.number_input("Minutes", min_value=0)
-            w_type = st.selectbox("Type", ["Strength", "Cardio", "Yoga", "Rest"])
+            w_type = st.selectbox("Type", WORKOUT_TYPES)
             if st.form_submit_button("Save Stats"):
-                conn.execute("INSERT OR REPLACE INTO daily_stats VALUES (?,?,?,?,?)", 
-                             (str(log_date), weight, active_cal, mins, w_type))
+                conn.execute(UPSERT_STATS, (to_day(log_date), weight, active_cal, mins, w_type))
                 conn.commit()
-                st.success("Stats Saved!")
+                st.session_state['saved'] = "Stats Saved!"
+                st.rerun(scope="app")
     else:
         with st.form("nutrition_form"):
             log_date = st.date_input("Date", date.today())
@@ -117,33 +388,55 @@ with st.sidebar:
             carbs = st.number_input("Carbs (g)", min_value=0)
             fat = st.number_input("Fat (g)", min_value=0)
             if st.form_submit_button("Save Nutrition"):
-                conn.execute("INSERT OR REPLACE INTO nutrition VALUES (?,?,?,?,?)", 
-                             (str(log_date), cal_in, protein, carbs, fat))
+                conn.execute(UPSERT_NUTRITION, (to_day(log_date), cal_in, protein, carbs, fat))
                 conn.commit()
-                st.success("Nutrition Saved!")
+                st.session_state['saved'] = "Nutrition Saved!"
+                st.rerun(scope="app")
+
+    # Backfill history by pasting CSV for whichever table is selected
+    sql, columns = (UPSERT_STATS, STATS_COLUMNS) if menu == "Physical Stats" else (UPSERT_NUTRITION, NUTRITION_COLUMNS)
+    with st.expander("Bulk Import (CSV)"):
+        with st.form(f"bulk_form_{menu}"):
+            pasted = st.text_area("Paste rows", placeholder=','.join(columns))
+            if st.form_submit_button("Import"):
+                try:
+                    rows = parse_bulk_csv(pasted, columns)
+                except ValueError as e:
+                    st.error(f"Could not import: {e}")
+                else:
+                    save_many(sql, rows)
+                    st.session_state['saved'] = f"Imported {len(rows)} row(s)!"
+                    st.rerun(scope="app")
+
+    if 'saved' in st.session_state:
+        st.success(st.session_state.pop('saved'))
+
+with st.sidebar:
+    input_sidebar()
 
 # --- 4. DATA ANALYSIS ---
-df_stats = pd.read_sql_query("SELECT * FROM daily_stats", conn)
-df_nutr = pd.read_sql_query("SELECT * FROM nutrition", conn)
+version = db_version()
+stats = load_stats(version)
+df_nutr = load_nutrition(version)
 
-if not df_stats.empty and len(df_stats) >= 2:
-    df_sorted = df_stats.sort_values('date')
-    
-    # NEW: Merge datasets for correlation storytelling
-    df_combined = pd.merge(df_sorted, df_nutr, on='date', how='inner')
+if len(stats) >= 2:
+    # NEW: Join datasets for correlation storytelling
+    df_combined = load_energy(version)
 
     tab1, tab2, tab3, tab4 = st.tabs(["Weight", "Activity", "Nutrition", "Energy Balance"])
 
     with tab1:
-        # (Your existing Weight Capability and I-MR code here)
-        st.plotly_chart(plot_imr_combined(df_sorted, 'weight', 'Weight'), use_container_width=True)
+        # The session keeps its own copy, so patching it never touches the shared cached figure
+        fig_weight = session_figure('weight', version,
+                                    build=lambda: go.Figure(plot_imr_combined(stats, 'weight', 'Weight')),
+                                    update=lambda fig: update_imr(fig, stats, 'weight'))
+        st.plotly_chart(fig_weight, use_container_width=True)
 
     with tab3:
         if not df_nutr.empty:
             st.subheader("Daily Macro Distribution")
             # Simple bar chart for macros
-            nutr_sorted = df_nutr.sort_values('date')
-            fig_macro = px.bar(nutr_sorted, x='date', y=['protein', 'carbs', 'fat'], title="Macros Over Time")
+            fig_macro = session_figure('macros', version, lambda: plot_macros(df_nutr))
             st.plotly_chart(fig_macro, use_container_width=True)
         else:
             st.info("Log nutrition data to see analysis.")
@@ -151,9 +444,8 @@ if not df_stats.empty and len(df_stats) >= 2:
     with tab4:
         st.subheader("Net Energy Analysis")
         if not df_combined.empty:
-            # Storytelling: Calculate Net Calories
-            df_combined['net_calories'] = df_combined['calories_in'] - df_combined['active_calories'] - 2000 # Assuming 2000 BMR
-            st.line_chart(df_combined, x='date', y='net_calories')
+            fig_net = session_figure('net_energy', version, lambda: plot_net_energy(df_combined))
+            st.plotly_chart(fig_net, use_container_width=True)
             st.caption("Net Calories = (In) - (Active Burn) - (Estimated 2000 BMR)")
         else:
             st.info("Log both stats and nutrition for the same dates to see the balance.")
\ No newline at end of file